@@ -0,0 +1,44 @@
+import streamlit as st
+import gspread
+import tenacity
+from google.oauth2.service_account import Credentials
+
+# Define the scope for Google Sheets
+scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+# Spreadsheet shared by the scraper, the summariser and the app
+spreadsheet_id = "1BzTJgX7OgaA0QNfzKs5AgAx2rvZZjDdorgAz0SD9NZg"
+
+
+@st.cache_resource
+def get_sheet():
+    """
+    Authorizes gspread and opens the spreadsheet once per process (not at import).
+    Every module imports this one function, so they all share the same cached
+    handle instead of each authorizing its own client.
+    """
+    creds_dict = st.secrets["service_account"]  # Must match your secrets.toml or Streamlit Cloud secrets
+    creds = Credentials.from_service_account_info(creds_dict, scopes=scope)
+    client = gspread.authorize(creds)
+    # (connect, read) seconds – gspread defaults to no timeout, and a stalled read
+    # would otherwise hold the shared run guard (and its lock) indefinitely
+    client.set_timeout((5, 30))
+    return client.open_by_key(spreadsheet_id)
+
+
+def _is_transient_api_error(exc: BaseException) -> bool:
+    # rate limits and server-side hiccups are worth asking again for
+    return (
+        isinstance(exc, gspread.exceptions.APIError)
+        and exc.response.status_code in (429, 500, 502, 503, 504)
+    )
+
+
+# Bounded backoff for idempotent Sheets reads/updates (gets and range overwrites).
+# Appends must not use it – a 5xx after the write landed would add a second row.
+retry_sheets = tenacity.retry(
+    retry=tenacity.retry_if_exception(_is_transient_api_error),
+    stop=tenacity.stop_after_attempt(5),
+    wait=tenacity.wait_exponential_jitter(initial=0.5, max=5),
+    reraise=True,
+)
@@ -12,17 +12,29 @@ Phase 1 refactor – v1.2 (10 Jul 2025)
 # ---------- stdlib ----------
 import asyncio
 import datetime as dt
-import time
-from typing import List
+import functools
+import hashlib
+import os
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 # ---------- third‑party ----------
 import gspread
 import httpx
+import orjson
+import tenacity
+from diskcache import Cache
 from bs4 import BeautifulSoup
 import streamlit as st
-from google.oauth2.service_account import Credentials
-from pytrends.exceptions import TooManyRequestsError
-from serpapi import GoogleSearch
+
+from app_common import get_sheet, retry_sheets
+from html_meta import regex_meta
+
+try:  # optional – libuv loop is cheaper per await on Linux/macOS
+    import uvloop
+except ImportError:
+    uvloop = None
 
 # ---------------------------------------------------------------------
 # CONFIG – tweak here
@@ -31,6 +43,23 @@ CAP_NEWS         = 40   # max unique rows kept in “Google News”
 CAP_TOP_STORIES  = 40   # max rows kept in “Top Stories”
 CAP_TRENDS       = 20   # max rows in each Trends sheet
 DEBUG_COUNTS     = False  # True prints raw vs. deduped counts
+HTTP_CACHE_DIR   = ".http_cache"   # on‑disk SerpAPI + meta description cache
+SERP_CACHE_TTL   = 3600            # seconds a cached SerpAPI result stays valid
+META_CACHE_TTL   = 7 * 24 * 3600   # seconds a cached meta stays valid
+HEAD_READ_CAP    = 32 * 1024       # stop downloading a page after this many bytes
+META_CONCURRENCY = 25              # in‑flight meta fetches (mostly distinct hosts)
+META_ATTEMPTS    = 3               # tries per URL on 429/5xx/timeouts
+RETRY_STATUSES   = {429, 500, 502, 503, 504}
+
+# Redirect wrappers / paywalls whose meta is blocked or missing – don't
+# spend a request on them, use the SerpAPI snippet (subdomains match too)
+SNIPPET_ONLY_HOSTS = {
+    "news.google.com",
+    "wsj.com",
+    "afr.com",
+    "ft.com",
+    "bloomberg.com",
+}
 
 BROWSER_HEADERS = {
     "User-Agent": (
@@ -41,31 +70,71 @@ BROWSER_HEADERS = {
     "Accept-Language": "en-US,en;q=0.9",
 }
 
+HTTP_CACHE = Cache(HTTP_CACHE_DIR)
+
+# One pooled client per run – keep‑alive reused across every meta fetch
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=30, max_connections=60)
+
 # ---------------------------------------------------------------------
 # 1  Google Sheets client & SerpAPI key
 # ---------------------------------------------------------------------
-SCOPE = [
-    "https://spreadsheets.google.com/feeds",
-    "https://www.googleapis.com/auth/drive",
-]
-
-creds_dict = st.secrets["service_account"]
-creds      = Credentials.from_service_account_info(creds_dict, scopes=SCOPE)
-client     = gspread.authorize(creds)
-
-SPREADSHEET_ID = "1BzTJgX7OgaA0QNfzKs5AgAx2rvZZjDdorgAz0SD9NZg"
-sheet          = client.open_by_key(SPREADSHEET_ID)
-
-SERP_API_KEY = st.secrets["serpapi"]["api_key"]
+SERP_API_KEY    = st.secrets["serpapi"]["api_key"]
+SERPAPI_URL     = "https://serpapi.com/search.json"
+SERPAPI_TIMEOUT = 30   # live scrapes can take a while
 
 # ---------------------------------------------------------------------
 # 2  SerpAPI fetch helpers
 # ---------------------------------------------------------------------
-def fetch_google_news() -> List[dict]:
+def _is_transient(exc: BaseException) -> bool:
+    # timeouts / resets, or an HTTP status worth asking again for
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRY_STATUSES
+    return isinstance(exc, httpx.TransportError)
+
+
+def _log_retry(state: tenacity.RetryCallState):
+    print(f"Retrying {state.fn.__name__} (attempt {state.attempt_number}) "
+          f"after {state.outcome.exception()!r}")
+
+
+# Shared backoff for every network call; meta fetches use a tighter wait
+# so one slow site can't hold up the whole scrape.
+retry_network = functools.partial(
+    tenacity.retry,
+    retry=tenacity.retry_if_exception(_is_transient),
+    stop=tenacity.stop_after_attempt(4),
+    wait=tenacity.wait_random_exponential(multiplier=1, max=30),
+    reraise=True,
+)
+
+
+@retry_network(before_sleep=_log_retry)
+async def _serp(client: httpx.AsyncClient, params: dict) -> dict:
+    # Plain GET on a pooled client (the SDK opened a fresh `requests`
+    # connection per query). 429/5xx raise (and are retried) – other error
+    # payloads come back as JSON with an "error" key, as with the SDK.
+    # Reruns inside the TTL are answered from disk unless no_cache is set.
+    key = "serp:" + hashlib.sha1(
+        orjson.dumps({k: v for k, v in params.items() if k != "api_key"},
+                     option=orjson.OPT_SORT_KEYS)
+    ).hexdigest()
+    use_cache = params.get("no_cache") != "true"
+    if use_cache and (cached := HTTP_CACHE.get(key)) is not None:
+        return cached
+
+    r = await client.get(SERPAPI_URL, params=params, timeout=SERPAPI_TIMEOUT)
+    if r.status_code in RETRY_STATUSES:
+        r.raise_for_status()
+    results = orjson.loads(r.content)
+    if "error" not in results:
+        HTTP_CACHE.set(key, results, expire=SERP_CACHE_TTL)
+    return results
+
+
+async def fetch_google_news(client: httpx.AsyncClient) -> List[dict]:
     params = {
         "api_key": SERP_API_KEY,
         "engine": "google",
-        "no_cache": "true",
         "q": "asx 200",
         "google_domain": "google.com.au",
         "tbs": "qdr:d",
@@ -75,20 +144,23 @@ def fetch_google_news() -> List[dict]:
         "tbm": "nws",
         "num": "40",
     }
-    return GoogleSearch(params).get_dict().get("news_results", [])
+    # Let SerpAPI serve its cached result unless a live scrape is forced
+    if os.getenv("FORCE_REFRESH"):
+        params["no_cache"] = "true"
+    return (await _serp(client, params)).get("news_results", [])
 
 
-def fetch_google_top_stories() -> List[dict]:
+async def fetch_google_top_stories(client: httpx.AsyncClient) -> List[dict]:
     params = {
         "api_key": SERP_API_KEY,
         "q": "asx+200",
         "hl": "en",
         "gl": "au",
     }
-    return GoogleSearch(params).get_dict().get("top_stories", [])
+    return (await _serp(client, params)).get("top_stories", [])
 
 
-def fetch_google_trends():
+async def fetch_google_trends(client: httpx.AsyncClient):
     params = {
         "api_key": SERP_API_KEY,
         "engine": "google_trends",
@@ -99,19 +171,22 @@ def fetch_google_trends():
         "date": "now 4-H",
     }
 
-    attempts = 0
-    while attempts < 5:
-        try:
-            results = GoogleSearch(params).get_dict()
-            rising = results.get("related_queries", {}).get("rising", [])
-            top    = results.get("related_queries", {}).get("top",    [])
-            return rising, top
-        except TooManyRequestsError:
-            wait = (2 ** attempts) * 10
-            print(f"Google Trends rate‑limited – sleeping {wait}s")
-            time.sleep(wait)
-            attempts += 1
-    raise RuntimeError("Google Trends fetch failed after multiple attempts.")
+    results = await _serp(client, params)
+    rising = results.get("related_queries", {}).get("rising", [])
+    top    = results.get("related_queries", {}).get("top",    [])
+    return rising, top
+
+
+async def fetch_all_serpapi():
+    # The three queries are independent – overlap them on one client so the
+    # stage costs max() rather than sum() of the SerpAPI round‑trips.
+    async with _new_async_client() as client:
+        news, top_stories, (rising, top) = await asyncio.gather(
+            fetch_google_news(client),
+            fetch_google_top_stories(client),
+            fetch_google_trends(client),
+        )
+    return news, top_stories, rising, top
 
 # ---------------------------------------------------------------------
 # 3  Worksheet utilities
@@ -123,139 +198,231 @@ def ensure_worksheet_exists(sheet_obj, title: str):
         return sheet_obj.add_worksheet(title=title, rows="100", cols="20")
 
 
-def overwrite_worksheet(ws, header: List[str], rows: List[List]):
-    ws.resize(rows=len(rows) + 1, cols=len(header))
-    ws.update(
-        range_name="A1",
-        values=[header] + rows,
-        value_input_option="USER_ENTERED",
-    )
+@functools.lru_cache(maxsize=None)
+def cached_worksheet(sheet_obj, title: str):
+    # Each worksheet() lookup is a metadata round‑trip; a long‑lived
+    # Streamlit process only needs to pay it once per tab.
+    return ensure_worksheet_exists(sheet_obj, title)
+
+
+# `tables` maps worksheet title -> (header, rows) for the helpers below.
+Tables = Dict[str, Tuple[List[str], List[List]]]
+
+def resize_worksheets(sheet_obj, tables: Tables):
+    """Size every tab to exactly fit its data in one batchUpdate.
+
+    Only row/column counts are read, so this can run before the row
+    contents are final. Shrinking drops stale rows from a longer run.
+    """
+    requests = []
+    for title, (header, rows) in tables.items():
+        ws = cached_worksheet(sheet_obj, title)
+        requests.append({
+            "updateSheetProperties": {
+                "properties": {
+                    "sheetId": ws.id,
+                    "gridProperties": {"rowCount": len(rows) + 1, "columnCount": len(header)},
+                },
+                "fields": "gridProperties(rowCount,columnCount)",
+            }
+        })
+    sheet_obj.batch_update({"requests": requests})
+
+
+@retry_sheets
+def write_worksheets(sheet_obj, tables: Tables):
+    """Write header + rows for every tab in one values batchUpdate."""
+    sheet_obj.values_batch_update({
+        "valueInputOption": "USER_ENTERED",
+        "data": [
+            {"range": f"'{title}'!A1", "values": [header] + rows}
+            for title, (header, rows) in tables.items()
+        ],
+    })
 
 # ---------------------------------------------------------------------
 # 4  Data hygiene helpers
 # ---------------------------------------------------------------------
 def dedupe_rows(rows: List[List], key_index: int, keep_n: int) -> List[List]:
-    seen, out = set(), []
+    # dict keeps insertion order – first row per key wins
+    kept: Dict = {}
     for row in rows:
-        key = row[key_index]
-        if key not in seen:
-            seen.add(key)
-            out.append(row)
-        if len(out) >= keep_n:
+        if len(kept) >= keep_n:
             break
-    return out
+        kept.setdefault(row[key_index], row)
+    return list(kept.values())
 
 # ---------------------------------------------------------------------
 # 5  Concurrent meta‑description fetch
 # ---------------------------------------------------------------------
-async def _grab_desc(session: httpx.AsyncClient, url: str) -> str:
+def run_async(coro):
+    """asyncio.run, but on a uvloop event loop when uvloop is installed."""
+    loop_factory = uvloop.new_event_loop if uvloop else None
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        return runner.run(coro)
+
+# Fast path is html_meta.regex_meta: pull <meta name="description"> straight
+# from the <head> bytes instead of building a full DOM per page.
+def _soup_meta(content: bytes) -> str:
+    # regex miss (odd markup) – fall back to a real parser
+    soup = BeautifulSoup(content, "lxml")
+    tag  = soup.find("meta", attrs={"name": "description"})
+    return (
+        tag["content"].strip()
+        if tag and "content" in tag.attrs and tag["content"].strip()
+        else "No Meta Description"
+    )
+
+@retry_network(
+    stop=tenacity.stop_after_attempt(META_ATTEMPTS),
+    wait=tenacity.wait_random_exponential(multiplier=0.5, max=2),
+)
+async def _fetch_head(session: httpx.AsyncClient, url: str) -> Tuple[int, bytes, Optional[str]]:
+    # Only <head> matters – stream and hang up once it's closed
+    async with session.stream("GET", url) as r:
+        if r.status_code in RETRY_STATUSES:
+            r.raise_for_status()
+        if r.status_code != 200:
+            return r.status_code, b"", None
+        buf = bytearray()
+        async for chunk in r.aiter_bytes(4096):
+            tail = max(len(buf) - 6, 0)
+            buf += chunk
+            if buf.find(b"</head>", tail) != -1 or len(buf) >= HEAD_READ_CAP:
+                break
+        return r.status_code, bytes(buf), r.encoding
+
+async def _fetch_desc(session: httpx.AsyncClient, url: str) -> str:
     if not url or not url.startswith("http"):
         return "Invalid URL"
     try:
-        r = await session.get(url, timeout=10, headers=BROWSER_HEADERS)
-        if r.status_code != 200:
-            return f"HTTP {r.status_code}"
-        soup = BeautifulSoup(r.content, "lxml")
-        tag  = soup.find("meta", attrs={"name": "description"})
-        return (
-            tag["content"].strip()
-            if tag and "content" in tag.attrs and tag["content"].strip()
-            else "No Meta Description"
-        )
+        status, page, encoding = await _fetch_head(session, url)
+        if status != 200:
+            return f"HTTP {status}"
+        desc = regex_meta(page, encoding)
+        # full parse is CPU‑bound – keep it off the event loop
+        return desc if desc is not None else await asyncio.to_thread(_soup_meta, page)
+    except httpx.HTTPStatusError as e:  # still 429/5xx after retries
+        return f"HTTP {e.response.status_code}"
     except Exception:
         return "Error Fetching Description"
 
-async def fetch_meta_descriptions(urls: List[str], limit: int = 10) -> List[str]:
+async def _grab_desc(session: httpx.AsyncClient, url: str) -> str:
+    # Links recur across runs – serve known metas from disk, skip the GET
+    cached = HTTP_CACHE.get(url)
+    if cached is not None:
+        return cached
+    desc = await _fetch_desc(session, url)
+    if not desc.startswith(("HTTP", "Error", "Invalid")):
+        HTTP_CACHE.set(url, desc, expire=META_CACHE_TTL)
+    return desc
+
+def _new_async_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        headers=BROWSER_HEADERS,
+        timeout=10,
+        limits=HTTP_LIMITS,
+        http2=True,
+    )
+
+async def fetch_meta_descriptions(
+    urls: List[str],
+    limit: int = META_CONCURRENCY,
+    client: Optional[httpx.AsyncClient] = None,
+) -> List[str]:
+    if client is None:
+        async with _new_async_client() as own_client:
+            return await fetch_meta_descriptions(urls, limit, own_client)
+
     sem = asyncio.Semaphore(limit)
-    async with httpx.AsyncClient(follow_redirects=True) as session:
-        async def bound(u):
-            async with sem:
-                return await _grab_desc(session, u)
-        return await asyncio.gather(*(bound(u) for u in urls))
+    async def bound(u):
+        async with sem:
+            return await _grab_desc(client, u)
+    return await asyncio.gather(*(bound(u) for u in urls))
+
+def _snippet_only(url: str) -> bool:
+    host = urlsplit(url).hostname or ""
+    return any(host == h or host.endswith("." + h) for h in SNIPPET_ONLY_HOSTS)
+
+async def _fetch_metas_by_url(urls: List[str], limit: int = META_CONCURRENCY) -> Dict[str, str]:
+    # News and Top Stories overlap heavily – fetch each distinct link once.
+    # Snippet‑only hosts are left out of the result entirely.
+    # (An AsyncClient can't outlive the event loop that run_async creates.)
+    unique = [u for u in dict.fromkeys(urls) if not _snippet_only(u)]
+    async with _new_async_client() as client:
+        metas = await fetch_meta_descriptions(unique, limit, client)
+    return dict(zip(unique, metas))
 
 # ---------------------------------------------------------------------
 # 6  Storage orchestrator
 # ---------------------------------------------------------------------
+def _story_row(item: dict) -> List:
+    # Title, Link, Snippet + a slot for the meta description filled in later
+    return [
+        item.get("title")   or "No Title",
+        item.get("link")    or "No Link",
+        item.get("snippet") or "No Snippet",
+        None,
+    ]
+
+
 def store_data_in_google_sheets(news_data, top_stories_data, rising_data, top_data):
     # ---------- Google News ----------
-    news_rows = [
-        [a.get("title") or "No Title",
-         a.get("link")  or "No Link",
-         a.get("snippet") or "No Snippet"]
-        for a in news_data
-    ]
+    news_rows = [_story_row(a) for a in news_data]
     if DEBUG_COUNTS:
-        print(f"Google News – raw: {len(news_rows)}, unique links: {len({r[1] for r in news_rows})}")
-
+        print(f"Google News – raw: {len(news_rows)}, unique links: {len({r[1] for r in news_rows})}")
     news_rows = dedupe_rows(news_rows, key_index=1, keep_n=CAP_NEWS)
-    snippet_lookup_news = {r[1]: r[2] for r in news_rows}  # link -> snippet
-
-    news_meta = asyncio.run(fetch_meta_descriptions([r[1] for r in news_rows]))
-    for row, meta in zip(news_rows, news_meta):
-        # append fetched meta or placeholder
-        row.append(meta if meta else "No Meta Description")
-        # fallback to snippet if meta fetch failed
-        if meta.startswith("HTTP") or meta.startswith("Error"):
-            row[-1] = snippet_lookup_news.get(row[1], "No Meta Description")
-
-    overwrite_worksheet(
-        ensure_worksheet_exists(sheet, "Google News"),
-        ["Title", "Link", "Snippet", "Meta Description"],
-        news_rows,
-    )
 
     # ---------- Top Stories ----------
-    top_rows = [
-        [s.get("title") or "No Title",
-         s.get("link")  or "No Link",
-         s.get("snippet") or "No Snippet"]
-        for s in top_stories_data
-    ]
+    top_rows = [_story_row(s) for s in top_stories_data]
     if DEBUG_COUNTS:
-        print(f"Top Stories – raw: {len(top_rows)}")
-
+        print(f"Top Stories – raw: {len(top_rows)}")
     top_rows = dedupe_rows(top_rows, key_index=1, keep_n=CAP_TOP_STORIES)
-    snippet_lookup_top = {r[1]: r[2] for r in top_rows}
-
-    top_meta = asyncio.run(fetch_meta_descriptions([r[1] for r in top_rows]))
-    for row, meta in zip(top_rows, top_meta):
-        row.append(meta if meta else "No Meta Description")
-        if meta.startswith("HTTP") or meta.startswith("Error"):
-            row[-1] = snippet_lookup_top.get(row[1], "No Meta Description")
-
-    overwrite_worksheet(
-        ensure_worksheet_exists(sheet, "Top Stories"),
-        ["Title", "Link", "Snippet", "Meta Description"],
-        top_rows,
-    )
 
-    # ---------- Google Trends Rising ----------
-    rising_rows = [[q.get("query"), q.get("value")] for q in rising_data][:CAP_TRENDS]
-    overwrite_worksheet(
-        ensure_worksheet_exists(sheet, "Google Trends Rising"),
-        ["Query", "Value"],
-        rising_rows,
-    )
+    # ---------- Google Trends Rising / Top ----------
+    rising_rows = [[q.get("query"), q.get("value")] for q in islice(rising_data, CAP_TRENDS)]
+    top_rows_q  = [[q.get("query"), q.get("value")] for q in islice(top_data, CAP_TRENDS)]
 
-    # ---------- Google Trends Top ----------
-    top_rows_q = [[q.get("query"), q.get("value")] for q in top_data][:CAP_TRENDS]
-    overwrite_worksheet(
-        ensure_worksheet_exists(sheet, "Google Trends Top"),
-        ["Query", "Value"],
-        top_rows_q,
-    )
+    tables = {
+        "Google News":          (["Title", "Link", "Snippet", "Meta Description"], news_rows),
+        "Top Stories":          (["Title", "Link", "Snippet", "Meta Description"], top_rows),
+        "Google Trends Rising": (["Query", "Value"], rising_rows),
+        "Google Trends Top":    (["Query", "Value"], top_rows_q),
+    }
+    run_async(_store_async(tables, news_rows + top_rows))
+
+
+async def _store_async(tables: Tables, story_rows: List[List]):
+    # Row counts are final after dedupe, so the worksheet lookups + resize
+    # go out on a worker thread while the meta descriptions are scraped.
+    sheet  = get_sheet()
+    resize = asyncio.create_task(asyncio.to_thread(resize_worksheets, sheet, tables))
+
+    # ---------- Meta descriptions (each unique link fetched once) ----------
+    url2meta = await _fetch_metas_by_url([r[1] for r in story_rows])
+    for row in story_rows:
+        meta = url2meta.get(row[1])
+        # fallback to the SerpAPI snippet if meta was skipped or failed
+        row[3] = row[2] if not meta or meta.startswith(("HTTP", "Error")) else meta
+
+    # ---------- Write all four tabs in one batch ----------
+    await resize
+    await asyncio.to_thread(write_worksheets, sheet, tables)
 
 # ---------------------------------------------------------------------
 # 7  Main entry point
 # ---------------------------------------------------------------------
-def main():
+def main(progress: Optional[Callable[[str], None]] = None):
+    # `progress` receives a short message at each stage (e.g. for a UI)
+    report = progress or (lambda msg: None)
     now_utc = dt.datetime.now(dt.UTC)
     print(f"=== Data scrape started {now_utc.isoformat(timespec='seconds')}Z ===")
 
-    news_data        = fetch_google_news()
-    top_stories_data = fetch_google_top_stories()
-    rising_data, top_data = fetch_google_trends()
+    report("Fetching Google News, Top Stories and Trends from SerpAPI...")
+    news_data, top_stories_data, rising_data, top_data = run_async(fetch_all_serpapi())
 
+    report("Fetching meta descriptions and writing to Google Sheets...")
     store_data_in_google_sheets(news_data, top_stories_data, rising_data, top_data)
     print("=== Data scrape finished ===")
 
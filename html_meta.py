@@ -0,0 +1,39 @@
+"""
+html_meta.py
+------------
+Regex fast path for <meta name="description">, kept free of the scraper's
+import-time secrets/cache setup so it can be imported (and tested) on its own.
+"""
+
+import html
+import re
+from typing import Optional
+
+# Pull <meta name="description"> straight from the <head> bytes (either
+# attribute order) instead of building a full DOM per page.
+# content value is exactly one quoted string (group 1 or 2), so a match can
+# never run on past its own tag into the next <meta>
+_META_CONTENT = rb'content\s*=\s*(?:"([^"]*)"|\'([^\']*)\')'
+_META_RE = re.compile(
+    rb'<meta\s[^>]*?name\s*=\s*["\']description["\'][^>]*?' + _META_CONTENT,
+    re.I,
+)
+_META_RE_REV = re.compile(
+    rb'<meta\s[^>]*?' + _META_CONTENT + rb'[^>]*?name\s*=\s*["\']description["\']',
+    re.I,
+)
+
+
+def regex_meta(content: bytes, encoding: Optional[str] = None) -> Optional[str]:
+    """
+    Returns the unescaped description, "No Meta Description" for an empty one,
+    or None when the regex finds no tag (caller falls back to a real parser).
+    """
+    end  = content.find(b"</head>")
+    head = content[:end] if end != -1 else content
+    m = _META_RE.search(head) or _META_RE_REV.search(head)
+    if not m:
+        return None
+    raw  = m.group(1) if m.group(1) is not None else m.group(2)
+    desc = html.unescape(raw.decode(encoding or "utf-8", "replace")).strip()
+    return desc or "No Meta Description"
@@ -1,66 +1,117 @@
 import streamlit as st
 import openai
-import gspread
 import pandas as pd
-import time
 import datetime as dt
-import pytz
-from google.oauth2.service_account import Credentials
+import hashlib
+from zoneinfo import ZoneInfo
+from diskcache import Cache
 
-# Define the scope for Google Sheets
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-
-# Load the service account info from Streamlit secrets
-creds_dict = st.secrets["service_account"]
-creds = Credentials.from_service_account_info(creds_dict, scopes=scope)
-client = gspread.authorize(creds)
-
-# Spreadsheet ID remains the same (update if needed)
-spreadsheet_id = "1BzTJgX7OgaA0QNfzKs5AgAx2rvZZjDdorgAz0SD9NZg"
-sheet = client.open_by_key(spreadsheet_id)
+from app_common import get_sheet, retry_sheets
 
 # Set your OpenAI API key from Streamlit secrets
 openai.api_key = st.secrets["openai"]["api_key"]
 
+# Model used for the briefs, and an on-disk cache of its output keyed by
+# the exact prompt (data + date + instructions) so identical input never
+# pays for a second completion
+summary_model = "gpt-4.1"
+summary_cache = Cache(".summary_cache")
+summary_cache_ttl = 7 * 24 * 3600  # seconds
 
-def read_data(sheet, title):
-    """Reads data from a specified Google Sheet worksheet into a pandas DataFrame."""
-    worksheet = sheet.worksheet(title)
-    data = worksheet.get_all_records()
-    return pd.DataFrame(data)
 
+# Source worksheets and the columns read from each
+source_ranges = {
+    "Google News": "A:D",
+    "Top Stories": "A:D",
+    "Google Trends Rising": "A:B",
+    "Google Trends Top": "A:B",
+}
 
-def format_data_for_prompt(news_data, top_stories_data, rising_data, top_data):
+
+@retry_sheets
+def read_all_data(sheet):
     """
-    Formats data from four different sources (news, top stories, trends rising, trends top)
-    into a single string for the prompt.
+    Reads every source worksheet in one values.batchGet request and returns
+    a DataFrame per worksheet, in source_ranges order (header row = columns).
+    """
+    ranges = [f"'{title}'!{cols}" for title, cols in source_ranges.items()]
+    response = sheet.values_batch_get(ranges)
+
+    frames = []
+    for value_range in response["valueRanges"]:
+        values = value_range.get("values", [])  # key is absent for an empty tab
+        header, rows = (values[0], values[1:]) if values else ([], [])
+        # The API drops trailing empty cells, so pad short rows out to the
+        # header width (as get_all_records did) before building the frame
+        width = len(header)
+        rows = [row[:width] + [""] * (width - len(row)) for row in rows]
+        frames.append(pd.DataFrame(rows, columns=header))
+    return frames
+
+
+# Caps on how much source data goes into the prompt; input tokens drive
+# both OpenAI cost and latency, and the briefs only use the top items
+max_news_rows = 25
+max_top_story_rows = 15
+max_trend_rows = 10  # the prompt asks for the top 10 trends
+max_snippet_chars = 200
+
+
+def trim_stories(df, max_rows):
     """
-    formatted_data = "Google News Data:\n"
-    for index, row in news_data.iterrows():
-        formatted_data += f"- Title: {row['Title']}, Link: {row['Link']}, Snippet: {row['Snippet']}\n"
+    Drops near-duplicate headlines (same first six words, case-insensitive),
+    keeps the first max_rows stories and shortens snippets for the prompt.
+    """
+    if df.empty or "Title" not in df or "Snippet" not in df:
+        return df.head(max_rows)
+    title_key = df["Title"].astype(str).str.lower().str.split().str[:6].str.join(" ")
+    df = df.loc[~title_key.duplicated()].head(max_rows).copy()
+    df["Snippet"] = df["Snippet"].astype(str).str[:max_snippet_chars]
+    return df
 
-    formatted_data += "\nTop Stories Data:\n"
-    for index, row in top_stories_data.iterrows():
-        formatted_data += f"- Title: {row['Title']}, Link: {row['Link']}, Snippet: {row['Snippet']}\n"
 
-    formatted_data += "\nGoogle Trends Rising Data:\n"
-    for index, row in rising_data.iterrows():
-        formatted_data += f"- Query: {row['Query']}, Value: {row['Value']}\n"
+def format_rows(df, columns):
+    """
+    Renders each row as "- Col: value, Col: value\n" using vectorised
+    string ops rather than iterrows() + repeated string concatenation.
+    """
+    if df.empty:
+        return ""
+    df = df.reindex(columns=columns).fillna("").astype(str)
+    line = f"{columns[0]}: " + df[columns[0]]
+    for col in columns[1:]:
+        line = line + f", {col}: " + df[col]
+    return ("- " + line + "\n").str.cat()
 
-    formatted_data += "\nGoogle Trends Top Data:\n"
-    for index, row in top_data.iterrows():
-        formatted_data += f"- Query: {row['Query']}, Value: {row['Value']}\n"
 
-    return formatted_data
+def format_data_for_prompt(news_data, top_stories_data, rising_data, top_data):
+    """
+    Formats data from four different sources (news, top stories, trends rising, trends top)
+    into a single string for the prompt.
+    """
+    story_cols = ["Title", "Link", "Snippet"]
+    trend_cols = ["Query", "Value"]
+    return "".join([
+        "Google News Data:\n",
+        format_rows(news_data, story_cols),
+        "\nTop Stories Data:\n",
+        format_rows(top_stories_data, story_cols),
+        "\nGoogle Trends Rising Data:\n",
+        format_rows(rising_data, trend_cols),
+        "\nGoogle Trends Top Data:\n",
+        format_rows(top_data, trend_cols),
+    ])
 
 
-def summarize_data(formatted_data):
+def summarize_data(formatted_data, on_update=None):
     """
     Summarize data using the o1-mini model with a single 'user' role message.
     We combine system-like instructions and user instructions into a single prompt.
+    The completion is streamed; if given, on_update(text_so_far) is called as
+    tokens arrive so a UI can render the summary progressively.
     """
     # >>> CHANGE: Use local time for the date in the summary <<<
-    local_tz = pytz.timezone("Australia/Sydney")  # or any other desired timezone
+    local_tz = ZoneInfo("Australia/Sydney")  # or any other desired timezone
     now_local = dt.datetime.now(local_tz)
     current_date = now_local.strftime("%Y-%m-%d")
 
@@ -130,38 +181,61 @@ def summarize_data(formatted_data):
         }
     ]
 
-    # Call the OpenAI API
+    # Same model + same prompt => reuse the earlier summary
+    cache_key = hashlib.sha1(f"{summary_model}\n{big_prompt}".encode("utf-8")).hexdigest()
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Call the OpenAI API (streamed)
     response = openai.ChatCompletion.create(
-        model="gpt-4.1",
-        messages=messages
+        model=summary_model,
+        messages=messages,
+        stream=True
     )
-    summary = response['choices'][0]['message']['content']
+    summary = ""
+    for chunk in response:
+        delta = chunk['choices'][0]['delta'].get('content', '')
+        if delta:
+            summary += delta
+            if on_update:
+                on_update(summary)
+    summary_cache.set(cache_key, summary, expire=summary_cache_ttl)
     return summary
 
 
 def store_summary_in_google_sheets(sheet, summary):
     """Stores the summary data in a 'Summaries' worksheet, appending a row."""
-    summary_sheet = sheet.worksheet("Summaries")
-    summary_sheet.append_row([summary])
-    time.sleep(1)  # Delay to prevent exceeding quota
+    # One values.append on the range (no worksheet() metadata lookup first)
+    sheet.values_append(
+        "Summaries!A1",
+        params={"valueInputOption": "RAW"},
+        body={"values": [[summary]]},
+    )
 
 
-def generate_summary():
+def generate_summary(on_update=None):
     """
     Pulls data from Google Sheets, summarizes using the AI model,
     stores the summary in the 'Summaries' worksheet, and returns it.
+    on_update is passed through to summarize_data for progressive display.
     """
-    # Read data from relevant worksheets
-    news_data = read_data(sheet, "Google News")
-    top_stories_data = read_data(sheet, "Top Stories")
-    rising_data = read_data(sheet, "Google Trends Rising")
-    top_data = read_data(sheet, "Google Trends Top")
+    sheet = get_sheet()
+
+    # Read data from relevant worksheets (single batched request)
+    news_data, top_stories_data, rising_data, top_data = read_all_data(sheet)
+
+    # Keep only what the briefs need before it becomes prompt tokens
+    news_data = trim_stories(news_data, max_news_rows)
+    top_stories_data = trim_stories(top_stories_data, max_top_story_rows)
+    rising_data = rising_data.head(max_trend_rows)
+    top_data = top_data.head(max_trend_rows)
 
     # Format all data into a single string
     formatted_data = format_data_for_prompt(news_data, top_stories_data, rising_data, top_data)
 
     # Generate summary via OpenAI
-    summary = summarize_data(formatted_data)
+    summary = summarize_data(formatted_data, on_update=on_update)
 
     # Store the summary in "Summaries" worksheet
     store_summary_in_google_sheets(sheet, summary)
@@ -1,8 +1,10 @@
 import streamlit as st
 import datetime as dt
-import pytz
-import gspread
-from google.oauth2.service_account import Credentials
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
 
 #
 # 1) PAGE CONFIG + BRAND STYLING
@@ -13,12 +15,18 @@ st.set_page_config(
     layout="centered"
 )
 
+# Roboto + Oswald from Google Fonts as <link> tags rather than CSS @import, so the
+# font fetches start in parallel with the page; display=swap paints text right away
+# with a fallback font.
+FONT_LINKS = (
+    '<link rel="preconnect" href="https://fonts.googleapis.com">'
+    '<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>'
+    '<link href="https://fonts.googleapis.com/css2?family=Roboto:wght@300;400;500;700;900'
+    '&family=Oswald:wght@400;700&display=swap" rel="stylesheet">'
+)
+
 BRAND_CSS = """
 <style>
-/* Load Roboto + Oswald from Google Fonts */
-@import url('https://fonts.googleapis.com/css?family=Roboto:300,400,500,700,900');
-@import url('https://fonts.googleapis.com/css?family=Oswald:400,700');
-
 /* :root variables for Motley Fool color palette */
 :root {
   --fool-gold: #ffb81c;
@@ -34,11 +42,10 @@ BRAND_CSS = """
   --fool-black:  #000000;
 }
 
-/* Override default font to Roboto for nearly all text */
+/* Override default font to Roboto for nearly all text
+   (text/background/primary colors come from the [theme] in .streamlit/config.toml) */
 html, body, [class*="css"]  {
   font-family: 'Roboto', sans-serif;
-  color: var(--fool-midgray);
-  background-color: #ffffff;
 }
 
 /* Streamlit's main title or h1 classes */
@@ -70,124 +77,239 @@ div.stButton > button {
 div.stButton > button:hover {
   background-color: #2a8b1c; /* darker green on hover */
 }
-
-/* Style st.success messages to use the brand green */
-.stAlert > div[role="alert"] {
-  background-color: #e3f6d8 !important;
-  border-left: 0.25rem solid var(--fool-green) !important;
-  color: var(--fool-midgray);
+/* Greyed out while a briefing run is in flight */
+div.stButton > button:disabled,
+div.stButton > button:disabled:hover {
+  background-color: #c8c9c7;
+  color: #fff;
+  cursor: not-allowed;
 }
 </style>
 """
-st.markdown(BRAND_CSS, unsafe_allow_html=True)
+st.markdown(FONT_LINKS + BRAND_CSS, unsafe_allow_html=True)
 
 #
 # 2) SET UP GOOGLE SHEETS CLIENT
 #
-scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds_dict = st.secrets["service_account"]  # Must match your secrets.toml or Streamlit Cloud secrets
-creds = Credentials.from_service_account_info(creds_dict, scopes=scope)
-client = gspread.authorize(creds)
-
-# Your Spreadsheet ID here:
-spreadsheet_id = "1BzTJgX7OgaA0QNfzKs5AgAx2rvZZjDdorgAz0SD9NZg"
-sheet = client.open_by_key(spreadsheet_id)
+from app_common import get_sheet, retry_sheets  # one cached handle shared with the backends
 
 #
 # 3) IMPORT YOUR SCRIPTS THAT DO THE REAL WORK
 #
-from data_retrieval_storage_news_engine import main as retrieve_and_store_data
-from step2_summarisation_with_easier_reading import generate_summary
+# The backends (pandas, openai, httpx, bs4, secrets reads) are imported inside the
+# worker at click time, so a fresh session paints the page without paying for them.
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 #
 # 4) HELPER FUNCTIONS FOR UTC TIMESTAMPS
 #
 
+@retry_sheets
 def get_last_run_info(sheet_obj):
     """
-    Reads the 'Metadata' worksheet for last-run time (stored as a string) and summary text.
-    Returns (last_run_utc, last_summary_text), where last_run_utc is offset-aware in UTC.
+    Reads the 'Metadata' worksheet for last-run time (stored as epoch seconds) and summary text.
+    Returns (last_run_ts, last_summary_text), where last_run_ts is an int (UTC epoch) or None.
     """
-    metadata_ws = sheet_obj.worksheet("Metadata")
-    last_run_time_str = metadata_ws.cell(2, 1).value  # A2
-    last_summary_text = metadata_ws.cell(2, 2).value  # B2
-
-    if last_run_time_str:
-        # Parse e.g. "2025-03-16 10:30:00" => naive datetime
-        naive_dt = dt.datetime.strptime(last_run_time_str, "%Y-%m-%d %H:%M:%S")
-        # Attach Python's builtin UTC to make it offset-aware
-        last_run_utc = naive_dt.replace(tzinfo=dt.UTC)
+    # One values.get round trip for A2:B2 (no worksheet() metadata lookup);
+    # the API omits "values" for an empty range and trailing empty cells
+    values = sheet_obj.values_get(
+        "Metadata!A2:B2", params={"valueRenderOption": "UNFORMATTED_VALUE"}
+    ).get("values", [])
+    row = (values[0] if values else []) + [None, None]
+    last_run, last_summary_text = row[0], row[1]
+
+    if isinstance(last_run, (int, float)):
+        if last_run < 1e8:
+            # The original update_cell wrote "YYYY-MM-DD HH:MM:SS" (UTC) as
+            # USER_ENTERED, which Sheets keeps as a date serial: days since 1899-12-30
+            last_run_ts = int((last_run - 25569) * 86400)
+        else:
+            last_run_ts = int(last_run)
+    elif last_run:
+        # Rows written as RAW ISO 8601 text before epoch timestamps; naive ones are UTC
+        parsed = dt.datetime.fromisoformat(last_run)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=dt.UTC)
+        last_run_ts = int(parsed.timestamp())
     else:
-        last_run_utc = None
+        last_run_ts = None
 
-    return last_run_utc, last_summary_text
+    return last_run_ts, last_summary_text
 
 
+@retry_sheets
 def set_last_run_info(sheet_obj, summary_text):
     """
-    Stores the new run time (offset-aware UTC) plus summary in row 2 of 'Metadata' sheet.
+    Stores the new run time (UTC epoch seconds) plus summary in row 2 of 'Metadata' sheet.
+    Returns the stored run time.
     """
-    metadata_ws = sheet_obj.worksheet("Metadata")
+    now_ts = int(time.time())
 
-    # get current time in offset-aware UTC
-    now_utc = dt.datetime.now(dt.UTC)  # recommended in Python 3.11+ rather than utcnow()
-
-    run_time_str = now_utc.strftime("%Y-%m-%d %H:%M:%S")  # e.g. "2025-03-16 10:30:00"
-
-    metadata_ws.update_cell(2, 1, run_time_str)
-    metadata_ws.update_cell(2, 2, summary_text)
+    # Timestamp + summary in a single values.update (no worksheet() lookup)
+    sheet_obj.values_update(
+        "Metadata!A2:B2",
+        params={"valueInputOption": "RAW"},
+        body={"values": [[now_ts, summary_text]]},
+    )
+    return now_ts
 
 
-def format_utc_as_local(utc_dt, tz_name="Australia/Sydney"):
+def format_ts_as_local(ts, tz_name="Australia/Sydney"):
     """
-    Converts a UTC datetime to a chosen local timezone for display.
+    Converts a UTC epoch timestamp to a chosen local timezone for display.
     """
-    if utc_dt is None:
+    if ts is None:
         return "No previous run recorded"
-    import pytz
-    local_zone = pytz.timezone(tz_name)
-    local_dt = utc_dt.astimezone(local_zone)
+    local_dt = dt.datetime.fromtimestamp(ts, ZoneInfo(tz_name))
     return local_dt.strftime("%Y-%m-%d %H:%M:%S")
 
 
 #
-# 5) COOLDOWN-AWARE FUNCTION - USING OFFSET-AWARE UTC
+# 5) BACKGROUND PIPELINE RUNNER
 #
-def run_all_cooldown(sheet_obj, cooldown_hours=3):
+@st.cache_resource
+def get_executor():
+    """One small worker pool per server process, shared by every session."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="briefing")
+
+
+@st.cache_resource
+def get_run_guard():
     """
-    Checks if enough time has passed since last run (X hours) using offset-aware UTC.
-    If yes, run data retrieval + summarization and store new summary/time.
-    If no, show the existing summary.
+    Process-wide lock + in-flight flag shared by every session, so two users
+    clicking at once can't both pass the cooldown check and start a run.
     """
-    # get offset-aware UTC "now"
-    now_utc = dt.datetime.now(dt.UTC)
+    return {"lock": threading.Lock(), "running": False}
 
-    last_run_utc, last_summary = get_last_run_info(sheet_obj)
 
-    if last_run_utc is not None:
-        elapsed_hours = (now_utc - last_run_utc).total_seconds() / 3600.0
+def start_pipeline(sheet_obj):
+    """
+    Submits data retrieval + summarization to the shared worker pool and returns
+    immediately. The worker records the run in Metadata before releasing the run
+    guard, and only posts (kind, payload) events to a queue kept in session_state;
+    show_pipeline_progress() renders them on the script thread.
+    """
+    events = queue.Queue()
+    ctx = get_script_run_ctx()
+
+    def worker():
+        # lets the backends use st.secrets / st.cache_resource
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            from data_retrieval_storage_news_engine import main as retrieve_and_store_data
+            from step2_summarisation_with_easier_reading import generate_summary
+
+            retrieve_and_store_data(progress=lambda msg: events.put(("progress", msg)))
+            events.put(("progress", "Generating summary..."))
+            summary = generate_summary(on_update=lambda text: events.put(("partial", text)))
+            run_ts = set_last_run_info(sheet_obj, summary)
+            events.put(("done", (run_ts, summary)))
+        except Exception as exc:
+            events.put(("error", exc))
+        finally:
+            get_run_guard()["running"] = False
+
+    get_executor().submit(worker)
+    st.session_state["briefing_job"] = {"events": events, "log": [], "partial": ""}
+
+
+@st.fragment(run_every=1)
+def show_pipeline_progress():
+    """
+    Polls the running job once a second without rerunning the whole page.
+    When the worker finishes, triggers a full rerun so main() can show the result.
+    """
+    job = st.session_state["briefing_job"]
+    outcome = None
+    while outcome is None:
+        try:
+            kind, payload = job["events"].get_nowait()
+        except queue.Empty:
+            break
+        if kind == "progress":
+            job["log"].append(payload)
+        elif kind == "partial":
+            job["partial"] = payload
+        else:
+            outcome = (kind, payload)
+
+    with st.status("Generating briefs...", expanded=True):
+        for msg in job["log"]:
+            st.write(msg)
+        if job["partial"]:
+            st.markdown(job["partial"])  # summary as it streams in
+
+    if outcome is None:
+        return
+
+    kind, payload = outcome
+    del st.session_state["briefing_job"]
+    if kind == "error":
+        st.session_state["briefing_error"] = payload
     else:
-        elapsed_hours = 9999  # force run if no previous
+        run_ts, summary = payload
+        st.session_state["last_run_ts"] = run_ts
+        st.session_state["last_summary"] = summary
+        st.session_state["briefing_result"] = summary
+        st.session_state["briefing_log"] = job["log"]
+    st.rerun()
+
 
-    if elapsed_hours < cooldown_hours:
-        st.write(f"**Briefs were last run at {format_utc_as_local(last_run_utc)} local time.**")
+#
+# 6) COOLDOWN-AWARE FUNCTION - USING UTC EPOCH SECONDS
+#
+def run_all_cooldown(sheet_obj, cooldown_hours=3):
+    """
+    Checks if enough time has passed since last run (X hours) using UTC epoch seconds.
+    If yes, start data retrieval + summarization in the background and return None.
+    If no, show and return the existing summary.
+    """
+    if "briefing_job" in st.session_state:
+        return None  # this session's own run is still in flight
+
+    now_ts = time.time()
+
+    def hours_since(run_ts):
+        if run_ts is None:
+            return 9999  # force run if no previous
+        return (now_ts - run_ts) / 3600.0
+
+    # Check-and-claim under one lock: the sheet is re-read and the in-flight flag
+    # set atomically, and the worker only clears the flag after writing Metadata.
+    guard = get_run_guard()
+    with guard["lock"]:
+        # A last-run time remembered in this session that is still inside the
+        # cooldown stays valid, so repeat clicks skip the Sheets read. Otherwise
+        # re-check the sheet, since another session may have run since.
+        last_run_ts = st.session_state.get("last_run_ts")
+        last_summary = st.session_state.get("last_summary")
+        if hours_since(last_run_ts) >= cooldown_hours:
+            last_run_ts, last_summary = get_last_run_info(sheet_obj)
+            st.session_state["last_run_ts"] = last_run_ts
+            st.session_state["last_summary"] = last_summary
+
+        elapsed_hours = hours_since(last_run_ts)
+        already_running = guard["running"]
+        if elapsed_hours >= cooldown_hours and not already_running:
+            guard["running"] = True
+
+    if already_running:
+        st.write("**Another user is generating briefs right now.** "
+                 "Click again in a few minutes to see them.")
+        return None
+    elif elapsed_hours < cooldown_hours:
+        st.write(f"**Briefs were last run at {format_ts_as_local(last_run_ts)} local time.**")
         remain = cooldown_hours - elapsed_hours
         st.write(f"You can run again in about **{remain:.1f}** hour(s).")
         st.write("Here is the existing summary from that run:")
         return last_summary
     else:
-        st.write("Step 1: Fetching and storing data...")
-        retrieve_and_store_data()
-
-        st.write("Step 2: Generating summary...")
-        summary_text = generate_summary()
-
-        set_last_run_info(sheet_obj, summary_text)
-        return summary_text
+        start_pipeline(sheet_obj)
+        return None
 
 
 #
-# 6) MAIN STREAMLIT APP LOGIC
+# 7) MAIN STREAMLIT APP LOGIC
 #
 def main():
     st.title("Foolish Financial Briefings - Based on Trending News")
@@ -215,9 +337,27 @@ def main():
         "writers can use as inspiration for their article ideas."
     )
 
-    if st.button("Get Your Briefs!"):
-        summary = run_all_cooldown(sheet, cooldown_hours=3)
-        st.success("Process complete!")
+    running = "briefing_job" in st.session_state
+    summary = st.session_state.pop("briefing_result", None)
+    run_log = st.session_state.pop("briefing_log", None)
+
+    if st.button("Get Your Briefs!", disabled=running):
+        summary = run_all_cooldown(get_sheet(), cooldown_hours=3)
+        if "briefing_job" in st.session_state:
+            # Fragment reruns never redraw the button, so rerun the page once
+            # now to render it disabled for the rest of the run
+            st.rerun()
+
+    if "briefing_job" in st.session_state:
+        show_pipeline_progress()
+    elif "briefing_error" in st.session_state:
+        st.error(f"Briefing run failed: {st.session_state.pop('briefing_error')}")
+    elif summary is not None:
+        if run_log is not None:
+            # A finished run keeps its progress log in a collapsed, completed status
+            with st.status("Briefs ready", state="complete", expanded=False):
+                for msg in run_log:
+                    st.write(msg)
         st.subheader("AI-Generated Summary:")
         st.write(summary)
 
@@ -0,0 +1,19 @@
+from html_meta import regex_meta
+
+
+def test_content_stays_inside_its_own_tag():
+    head = (
+        b'<meta content="width=device-width" name="viewport">'
+        b'<meta content="Real desc" name="description">'
+    )
+    assert regex_meta(head) == "Real desc"
+
+
+def test_name_before_content_with_single_quotes():
+    head = b"<meta name='description' content='It&#39;s \"quoted\"'>"
+    assert regex_meta(head) == 'It\'s "quoted"'
+
+
+def test_empty_or_missing_description():
+    assert regex_meta(b'<meta name="description" content="">') == "No Meta Description"
+    assert regex_meta(b"<head><title>x</title></head>") is None